@@ -24,10 +24,14 @@ Benötigte Bibliotheken:
 - ujson (sollte bereits in MicroPython enthalten sein)
 """
 
+import gc
+import micropython
 import network
-import time
-import ujson
+import select
 from machine import Pin, PWM
+from micropython import const
+from time import sleep_ms, ticks_diff, ticks_ms
+from ujson import loads as json_loads
 from umqtt.simple import MQTTClient
 
 # ============================================
@@ -40,7 +44,7 @@ WIFI_PASSWORD = "DEIN_WIFI_PASSWORT"
 
 # MQTT Broker Einstellungen
 MQTT_BROKER = "192.168.1.100"  # IP-Adresse deines MQTT Brokers
-MQTT_PORT = 1883
+MQTT_PORT = const(1883)
 MQTT_USERNAME = ""  # Optional: MQTT Benutzername
 MQTT_PASSWORD = ""  # Optional: MQTT Passwort
 
@@ -48,9 +52,37 @@ MQTT_PASSWORD = ""  # Optional: MQTT Passwort
 DEVICE_ID = "pico_test"
 
 # LED Konfiguration
-LED_PIN = 16  # GPIO PIN für die LED
+LED_PIN = const(16)  # GPIO PIN für die LED
 LED_KEYWORD = "led"  # Telemetry Keyword - muss mit dem Widget in der App übereinstimmen
 
+# Debug-Ausgaben pro Command (1 = an, 0 = aus)
+# Mit 0 entfernt der Compiler die Ausgaben komplett aus dem Command-Pfad.
+DEBUG = const(0)
+
+# ============================================
+# KONSTANTEN
+# ============================================
+
+# Maximale Wartezeit auf eingehende MQTT-Nachrichten in Millisekunden
+MQTT_POLL_TIMEOUT_MS = const(1000)
+
+# Mindestabstand zwischen zwei manuellen Garbage Collections in Millisekunden
+GC_INTERVAL_MS = const(500)
+
+# Maximale Wartezeit für die WiFi-Verbindung in Millisekunden
+WIFI_TIMEOUT_MS = const(20000)
+
+# Wertbereich der App für PWM-Commands (0-1024)
+PWM_MAX_VALUE = const(1024)
+
+# Mindestabstand zwischen zwei Erfolgs-ACKs in Millisekunden.
+# Bei schnellen Slider-Bewegungen wird nur das letzte ACK gesendet.
+ACK_FLUSH_INTERVAL_MS = const(250)
+
+# Mindestabstand zwischen zwei PWM-Updates in Millisekunden (max. 50 Hz).
+# Schnellere Commands werden zusammengefasst, der letzte Wert wird immer gesetzt.
+PWM_MIN_INTERVAL_MS = const(20)
+
 # ============================================
 # GLOBALE VARIABLEN
 # ============================================
@@ -59,6 +91,10 @@ wlan = None
 mqtt_client = None
 led_pwm = None
 current_pwm_value = 0  # Aktueller PWM-Wert (0-1024)
+pending_ack = None  # Noch nicht gesendetes Erfolgs-ACK als (pin, value)
+last_ack_flush = 0  # Zeitpunkt (ticks_ms) des letzten gesendeten Erfolgs-ACKs
+pending_pwm_value = None  # Zurückgehaltener PWM-Wert bei zu schnellen Commands
+last_pwm_ms = 0  # Zeitpunkt (ticks_ms) des letzten PWM-Updates
 
 # MQTT Topics
 COMMAND_TOPIC = f"device/{DEVICE_ID}/command"
@@ -66,6 +102,89 @@ TELEMETRY_TOPIC = f"device/{DEVICE_ID}/telemetry/{LED_KEYWORD}"
 ACK_TOPIC = f"device/{DEVICE_ID}/ack"
 STATUS_TOPIC = f"device/{DEVICE_ID}/status"
 
+# Topics einmalig als Bytes kodieren (werden bei jedem Publish verwendet)
+COMMAND_TOPIC_B = COMMAND_TOPIC.encode()
+TELEMETRY_TOPIC_B = TELEMETRY_TOPIC.encode()
+ACK_TOPIC_B = ACK_TOPIC.encode()
+STATUS_TOPIC_B = STATUS_TOPIC.encode()
+
+# Status-Payloads
+STATUS_ONLINE = b"online"
+
+# Fehler-Codes für Fehler-ACKs. Kurze Codes statt Fehlertexte halten die
+# Payload klein - umqtt.simple kann bei größeren Nachrichten hängen bleiben.
+# Details stehen in der Shell-Ausgabe.
+ERROR_BAD_JSON = "bad_json"
+ERROR_BAD_TYPE = "bad_type"
+ERROR_BAD_PIN = "bad_pin"
+ERROR_BAD_VALUE = "bad_val"
+ERROR_INTERNAL = "internal"
+
+# Maximale Länge einer Fehlermeldung im Fehler-ACK
+ERROR_MESSAGE_MAX_LEN = const(64)
+
+# ============================================
+# PAYLOAD-PUFFER
+# ============================================
+
+# Telemetry und Erfolgs-ACK werden in feste Puffer geschrieben, damit beim
+# Senden keine neue Payload auf dem Heap angelegt wird (übrig bleibt nur der
+# kleine memoryview-Slice für publish()).
+# Der konstante Anfang des JSON steht bereits im Puffer, pro Nachricht werden
+# nur noch die Zahlen und der Rest ab dieser Position geschrieben.
+TELEMETRY_PREFIX = b'{"value":'
+TELEMETRY_SUFFIX = b',"unit":""}'
+ACK_SUCCESS_PREFIX = b'{"status":"success","data":{"pin":'
+ACK_SUCCESS_VALUE = b',"value":'
+ACK_SUCCESS_SUFFIX = b'}}'
+
+telemetry_buf = bytearray(64)
+telemetry_buf[:len(TELEMETRY_PREFIX)] = TELEMETRY_PREFIX
+telemetry_view = memoryview(telemetry_buf)
+
+ack_buf = bytearray(96)
+ack_buf[:len(ACK_SUCCESS_PREFIX)] = ACK_SUCCESS_PREFIX
+ack_view = memoryview(ack_buf)
+
+def write_bytes(buf, pos, data):
+    """Schreibt data ab Position pos in buf und gibt die neue Position zurück"""
+    end = pos + len(data)
+    buf[pos:end] = data
+    return end
+
+@micropython.native
+def write_int(buf, pos, value):
+    """Schreibt eine nicht-negative Ganzzahl als ASCII-Ziffern ab Position pos in buf"""
+    # Anzahl der Ziffern bestimmen, dann von hinten nach vorne schreiben
+    end = pos + 1
+    rest = value // 10
+    while rest:
+        end += 1
+        rest //= 10
+    
+    i = end
+    while i > pos:
+        i -= 1
+        buf[i] = 48 + value % 10  # 48 = ord("0")
+        value //= 10
+    
+    return end
+
+# ============================================
+# ZEIT-HILFSFUNKTIONEN
+# ============================================
+
+def interval_remaining_ms(since, interval_ms):
+    """Restzeit in ms, bis interval_ms seit since (ticks_ms) abgelaufen ist (0 = abgelaufen)"""
+    elapsed = ticks_diff(ticks_ms(), since)
+    
+    # ticks_diff() ist nur für Abstände unter TICKS_PERIOD/2 (ca. 6,2 Tage) gültig.
+    # Ein negativer Wert bedeutet einen veralteten Zeitstempel - dann gilt das
+    # Intervall ebenfalls als abgelaufen.
+    if elapsed < 0 or elapsed >= interval_ms:
+        return 0
+    return interval_ms - elapsed
+
 # ============================================
 # WIFI SETUP
 # ============================================
@@ -85,14 +204,18 @@ def setup_wifi():
     print(f"Verbinde mit WiFi: {WIFI_SSID}")
     wlan.connect(WIFI_SSID, WIFI_PASSWORD)
     
-    # Warte auf Verbindung (max. 20 Sekunden)
-    max_wait = 20
-    while max_wait > 0:
-        if wlan.status() < 0 or wlan.status() >= 3:
+    # Warte auf Verbindung (max. 20 Sekunden), erst kurz, dann immer länger
+    # (50 ms, 100 ms, ... bis max. 500 ms)
+    delay_ms = 50
+    waited_ms = 0
+    while waited_ms < WIFI_TIMEOUT_MS:
+        status = wlan.status()
+        if status < 0 or status >= 3:
             break
-        max_wait -= 1
         print(".", end="")
-        time.sleep(1)
+        sleep_ms(delay_ms)
+        waited_ms += delay_ms
+        delay_ms = min(delay_ms * 2, 500)
     
     if wlan.status() != 3:
         print("\n❌ WiFi-Verbindung fehlgeschlagen!")
@@ -102,84 +225,191 @@ def setup_wifi():
         print("\n✅ WiFi verbunden!")
         print(f"IP-Adresse: {wlan.ifconfig()[0]}")
 
+# ============================================
+# COMMAND PARSER - Schneller Pfad für GPIO-Commands
+# ============================================
+
+# GPIO-Commands der App haben immer die Form
+# {"type":"gpio","pin":16,"value":512,"mode":"output"} (Reihenfolge beliebig).
+# Für diese Form werden pin und value direkt aus den Bytes gelesen, ohne
+# ujson und ohne Dictionary. Alle anderen Payloads gehen über ujson.
+GPIO_TYPE_MARKER = b'"type":"gpio"'
+PIN_KEY = b'"pin":'
+VALUE_KEY = b'"value":'
+
+@micropython.native
+def parse_int_field(payload, key):
+    """Liest die Ganzzahl direkt hinter key aus der Payload (None, falls nicht möglich)"""
+    pos = payload.find(key)
+    if pos < 0:
+        return None
+    pos += len(key)
+    end = len(payload)
+    
+    negative = pos < end and payload[pos] == 45  # 45 = ord("-")
+    if negative:
+        pos += 1
+    
+    start = pos
+    result = 0
+    while pos < end and 48 <= payload[pos] <= 57:  # Ziffern "0"-"9"
+        result = result * 10 + payload[pos] - 48
+        pos += 1
+    
+    # Nur einfache Ganzzahlen direkt gefolgt von "," oder "}" akzeptieren
+    if pos == start or pos == end or (payload[pos] != 44 and payload[pos] != 125):
+        return None
+    
+    return -result if negative else result
+
 # ============================================
 # MQTT CALLBACK - Verarbeitet eingehende Commands
 # ============================================
 
+@micropython.native
 def mqtt_callback(topic, payload):
     """Handler für eingehende MQTT-Nachrichten"""
     global current_pwm_value
     
     try:
-        # Payload dekodieren
-        message = payload.decode('utf-8')
+        if DEBUG:
+            print(f"\n📥 Command empfangen:")
+            print(f"Topic: {topic.decode('utf-8')}")
+            print(f"Payload: {payload}")
         
-        print(f"\n📥 Command empfangen:")
-        print(f"Topic: {topic.decode('utf-8')}")
-        print(f"Payload: {message}")
+        # Schneller Pfad: GPIO-Command ohne JSON-Parser auswerten
+        if GPIO_TYPE_MARKER in payload:
+            pin = parse_int_field(payload, PIN_KEY)
+            value = parse_int_field(payload, VALUE_KEY)
+            if pin is not None and value is not None:
+                handle_gpio_command(pin, value)
+                return
         
-        # JSON parsen
-        cmd = ujson.loads(message)
+        # JSON direkt aus den Bytes parsen (ohne vorheriges decode)
+        cmd = json_loads(payload)
         
         # Command-Typ prüfen
         cmd_type = cmd.get("type", "")
         
         if cmd_type == "gpio":
-            handle_gpio_command(cmd)
+            handle_gpio_command(cmd.get("pin", -1), cmd.get("value", -1))
         else:
             print(f"⚠️ Unbekannter Command-Typ: {cmd_type}")
-            send_ack_error(f"Unbekannter Command-Typ: {cmd_type}")
+            send_ack_error(ERROR_BAD_TYPE)
             
     except ValueError as e:
         print(f"❌ JSON Parse Fehler: {e}")
-        send_ack_error(f"JSON Parse Fehler: {str(e)}")
+        send_ack_error(ERROR_BAD_JSON)
     except Exception as e:
         print(f"❌ Fehler beim Verarbeiten des Commands: {e}")
-        send_ack_error(f"Fehler: {str(e)}")
+        send_ack_error(ERROR_INTERNAL)
 
 # ============================================
 # GPIO COMMAND HANDLER
 # ============================================
 
-def handle_gpio_command(cmd):
+@micropython.native
+def handle_gpio_command(pin, value):
     """Verarbeitet GPIO-Commands"""
-    global current_pwm_value, led_pwm
-    
-    pin = cmd.get("pin", -1)
-    value = cmd.get("value", -1)
-    mode = cmd.get("mode", "output")
+    global pending_pwm_value
     
-    print(f"\n🔧 GPIO Command:")
-    print(f"  PIN: {pin}")
-    print(f"  Wert: {value}")
-    print(f"  Modus: {mode}")
+    if DEBUG:
+        print(f"\n🔧 GPIO Command:")
+        print(f"  PIN: {pin}")
+        print(f"  Wert: {value}")
     
     # Prüfe ob es unser LED-PIN ist
     if pin != LED_PIN:
         print(f"⚠️ Ignoriere Command für PIN {pin} (nicht konfiguriert)")
-        send_ack_error(f"PIN {pin} nicht konfiguriert")
+        send_ack_error(ERROR_BAD_PIN)
+        return
+    
+    # Über den ujson-Pfad können auch Floats ankommen - diese werden wie bisher
+    # abgeschnitten. PWM-Skalierung und Payload-Puffer erwarten int; andere Typen
+    # (Strings, Booleans, ...) werden abgelehnt.
+    raw_value = value
+    if type(value) is float:
+        try:
+            value = int(value)
+        except (ValueError, OverflowError):  # NaN bzw. Unendlich
+            value = None
+    if type(value) is not int:
+        print(f"❌ Ungültiger Wert: {raw_value} (keine Zahl)")
+        send_ack_error(ERROR_BAD_VALUE)
         return
     
     # Prüfe Wertbereich (0-1024 für PWM)
-    if value < 0 or value > 1024:
+    if value < 0 or value > PWM_MAX_VALUE:
         print(f"❌ Ungültiger Wert: {value} (muss 0-1024 sein)")
-        send_ack_error(f"Ungültiger Wert: {value} (muss 0-1024 sein)")
+        send_ack_error(ERROR_BAD_VALUE)
+        return
+    
+    # Wert bereits gesetzt: kein PWM-Update und kein Telemetry-Echo nötig
+    if value == current_pwm_value:
+        pending_pwm_value = None
+        queue_ack_success(LED_PIN, value)
         return
     
-    # Setze PWM-Wert
-    # Pico W PWM unterstützt 0-65535, aber wir verwenden 0-1024 für Kompatibilität
-    # Skaliere 0-1024 auf 0-65535 für volle PWM-Auflösung
-    pwm_duty = int((value / 1024) * 65535)
+    # Zu schnelle Commands zusammenfassen - die Hauptschleife setzt den letzten Wert
+    if interval_remaining_ms(last_pwm_ms, PWM_MIN_INTERVAL_MS):
+        pending_pwm_value = value
+        return
+    
+    pending_pwm_value = None
+    set_pwm_value(value)
+
+@micropython.viper
+def scale_pwm_duty(value: int) -> int:
+    """Skaliert einen PWM-Wert (0-1024) auf den Duty-Cycle des Pico W (0-65535)"""
+    # Pico W PWM unterstützt 0-65535, aber wir verwenden 0-1024 für Kompatibilität.
+    # Viper rechnet mit nativen Maschinen-Integern (der RP2040 hat keine FPU);
+    # die Division durch PWM_MAX_VALUE (1024) ist ein Shift um 10 Bit.
+    return (value * 65535) >> 10
+
+def set_pwm_value(value):
+    """Setzt die LED-Helligkeit und sendet Telemetry und ACK"""
+    global current_pwm_value, last_pwm_ms
+    
+    pwm_duty = scale_pwm_duty(value)
     led_pwm.duty_u16(pwm_duty)
     current_pwm_value = value
+    last_pwm_ms = ticks_ms()
     
-    print(f"✅ LED auf PIN {LED_PIN} gesetzt: PWM = {value} (duty = {pwm_duty})")
+    if DEBUG:
+        print(f"✅ LED auf PIN {LED_PIN} gesetzt: PWM = {value} (duty = {pwm_duty})")
     
     # Sende sofort Telemetry-Feedback (wichtig für Widgets!)
     send_telemetry(value)
     
-    # Sende Acknowledgment
-    send_ack_success(pin, value)
+    # Acknowledgment vormerken (wird gebündelt aus der Hauptschleife gesendet)
+    queue_ack_success(LED_PIN, value)
+
+def flush_pending_pwm():
+    """Setzt einen zurückgehaltenen PWM-Wert, sobald das Mindestintervall abgelaufen ist"""
+    global pending_pwm_value
+    
+    if pending_pwm_value is None:
+        return
+    if interval_remaining_ms(last_pwm_ms, PWM_MIN_INTERVAL_MS):
+        return
+    
+    value = pending_pwm_value
+    pending_pwm_value = None
+    set_pwm_value(value)
+
+def poll_timeout_ms():
+    """Wie lange die Hauptschleife höchstens auf neue Nachrichten warten darf"""
+    timeout = MQTT_POLL_TIMEOUT_MS
+    
+    # Zurückgehaltenen PWM-Wert nicht länger als nötig warten lassen
+    if pending_pwm_value is not None:
+        timeout = min(timeout, interval_remaining_ms(last_pwm_ms, PWM_MIN_INTERVAL_MS))
+    
+    # Vorgemerktes ACK spätestens nach ACK_FLUSH_INTERVAL_MS senden
+    if pending_ack is not None:
+        timeout = min(timeout, interval_remaining_ms(last_ack_flush, ACK_FLUSH_INTERVAL_MS))
+    
+    return timeout
 
 # ============================================
 # TELEMETRY SENDEN
@@ -188,13 +418,12 @@ def handle_gpio_command(cmd):
 def send_telemetry(value):
     """Sendet Telemetry-Daten an die App"""
     try:
-        payload = ujson.dumps({
-            "value": value,
-            "unit": ""
-        })
+        n = write_int(telemetry_buf, len(TELEMETRY_PREFIX), value)
+        n = write_bytes(telemetry_buf, n, TELEMETRY_SUFFIX)
         
-        mqtt_client.publish(TELEMETRY_TOPIC.encode(), payload.encode())
-        print(f"📤 Telemetry gesendet: {TELEMETRY_TOPIC} = {value}")
+        mqtt_client.publish(TELEMETRY_TOPIC_B, telemetry_view[:n], qos=0)
+        if DEBUG:
+            print(f"📤 Telemetry gesendet: {TELEMETRY_TOPIC} = {value}")
     except Exception as e:
         print(f"❌ Fehler beim Senden der Telemetry: {e}")
 
@@ -205,28 +434,47 @@ def send_telemetry(value):
 def send_ack_success(pin, value):
     """Sendet Erfolgs-Acknowledgment"""
     try:
-        payload = ujson.dumps({
-            "status": "success",
-            "data": {
-                "pin": pin,
-                "value": value
-            }
-        })
+        n = write_int(ack_buf, len(ACK_SUCCESS_PREFIX), pin)
+        n = write_bytes(ack_buf, n, ACK_SUCCESS_VALUE)
+        n = write_int(ack_buf, n, value)
+        n = write_bytes(ack_buf, n, ACK_SUCCESS_SUFFIX)
         
-        mqtt_client.publish(ACK_TOPIC.encode(), payload.encode())
-        print("✅ ACK gesendet: success")
+        mqtt_client.publish(ACK_TOPIC_B, ack_view[:n], qos=0)
+        if DEBUG:
+            print("✅ ACK gesendet: success")
     except Exception as e:
         print(f"❌ Fehler beim Senden des ACK: {e}")
 
+def queue_ack_success(pin, value):
+    """Merkt ein Erfolgs-Acknowledgment vor (ältere, ungesendete ACKs werden ersetzt)"""
+    global pending_ack
+    pending_ack = (pin, value)
+
+def flush_pending_ack():
+    """Sendet das vorgemerkte Erfolgs-Acknowledgment, sobald das Mindestintervall abgelaufen ist"""
+    global pending_ack, last_ack_flush
+    
+    if pending_ack is None:
+        return
+    if interval_remaining_ms(last_ack_flush, ACK_FLUSH_INTERVAL_MS):
+        return
+    
+    pin, value = pending_ack
+    pending_ack = None
+    last_ack_flush = ticks_ms()
+    send_ack_success(pin, value)
+
 def send_ack_error(error_message):
     """Sendet Fehler-Acknowledgment"""
     try:
-        payload = ujson.dumps({
-            "status": "error",
-            "error": error_message
-        })
+        # Länge begrenzen, damit die Payload klein bleibt
+        error_message = error_message[:ERROR_MESSAGE_MAX_LEN]
         
-        mqtt_client.publish(ACK_TOPIC.encode(), payload.encode())
+        # Anführungszeichen und Backslashes für JSON escapen
+        escaped = error_message.replace('\\', '\\\\').replace('"', '\\"')
+        payload = b'{"status":"error","error":"%s"}' % escaped.encode()
+        
+        mqtt_client.publish(ACK_TOPIC_B, payload, qos=0)
         print(f"❌ ACK gesendet: error - {error_message}")
     except Exception as e:
         print(f"❌ Fehler beim Senden des ACK: {e}")
@@ -236,10 +484,10 @@ def send_ack_error(error_message):
 # ============================================
 
 def send_status(status):
-    """Sendet Status-Nachricht"""
+    """Sendet Status-Nachricht (status als Bytes, z.B. STATUS_ONLINE)"""
     try:
-        mqtt_client.publish(STATUS_TOPIC.encode(), status.encode())
-        print(f"📡 Status gesendet: {status}")
+        mqtt_client.publish(STATUS_TOPIC_B, status, qos=0)
+        print(f"📡 Status gesendet: {status.decode()}")
     except Exception as e:
         print(f"❌ Fehler beim Senden des Status: {e}")
 
@@ -251,10 +499,10 @@ def connect_mqtt():
     """Stellt MQTT-Verbindung her"""
     global mqtt_client
     
-    client_id = f"MC_Connect_{DEVICE_ID}_{time.ticks_ms()}"
+    client_id = f"MC_Connect_{DEVICE_ID}_{ticks_ms()}".encode()
     
     mqtt_client = MQTTClient(
-        client_id.encode(),
+        client_id,
         MQTT_BROKER,
         MQTT_PORT,
         MQTT_USERNAME.encode() if MQTT_USERNAME else None,
@@ -264,25 +512,27 @@ def connect_mqtt():
     
     mqtt_client.set_callback(mqtt_callback)
     
+    # Client-ID und Client werden nur einmal erzeugt - bei Fehlversuchen wird
+    # nur die Verbindung neu aufgebaut
     while True:
         try:
             print("Verbinde mit MQTT Broker...", end="")
             mqtt_client.connect()
             print(" verbunden!")
             
-            # Command Topic abonnieren
-            mqtt_client.subscribe(COMMAND_TOPIC.encode())
+            # Command Topic abonnieren (QoS 0 - Commands sind idempotent, der letzte Wert gewinnt)
+            mqtt_client.subscribe(COMMAND_TOPIC_B, qos=0)
             print(f"Abonniert: {COMMAND_TOPIC}")
             
             # Status senden
-            send_status("online")
+            send_status(STATUS_ONLINE)
             
             return
             
         except Exception as e:
             print(f" fehlgeschlagen: {e}")
             print("Versuche es in 5 Sekunden erneut...")
-            time.sleep(5)
+            sleep_ms(5000)
 
 # ============================================
 # HAUPTPROGRAMM
@@ -307,18 +557,59 @@ def main():
     connect_mqtt()
     
     # Initialen Status senden
-    send_status("online")
+    send_status(STATUS_ONLINE)
     send_telemetry(current_pwm_value)
     
     print("\n✅ Setup abgeschlossen!")
     print("Bereit für Commands...\n")
     
+    last_ping = ticks_ms()
+    last_collect = ticks_ms()
+    dirty = False  # Seit der letzten Garbage Collection wurden Nachrichten verarbeitet
+    
+    # Auf eingehende Daten am MQTT-Socket warten, ohne den Socket selbst mit
+    # einem Timeout zu versehen
+    poller = select.poll()
+    poller.register(mqtt_client.sock, select.POLLIN)
+    
+    # Aufgeräumt wird vorzugsweise manuell in Ruhephasen, damit der Heap zu Beginn
+    # einer Folge von Slider-Commands leer ist und die automatische Garbage
+    # Collection nicht mitten in der Folge anläuft. Die automatische Collection
+    # bleibt aktiv: Sie läuft, falls der Heap während langer Folgen voll wird
+    # (nach gc.disable() gäbe es stattdessen einen MemoryError).
+    gc.collect()
+    
     # Hauptschleife
     try:
         while True:
-            # MQTT-Nachrichten verarbeiten
-            mqtt_client.check_msg()
-            time.sleep(0.1)  # Kurze Pause für Stabilität
+            # Warten, bis Daten am Socket anliegen (max. poll_timeout_ms()). Nur das
+            # Warten ist begrenzt - wait_msg() liest das Paket danach mit normalen,
+            # blockierenden Lesezugriffen vollständig, auch wenn es in mehreren
+            # TCP-Segmenten ankommt. Socket-Fehler (z.B. Verbindung vom Broker
+            # geschlossen) werden in wait_msg() ausgelöst und beenden die Hauptschleife.
+            idle = True
+            for _ in poller.ipoll(poll_timeout_ms()):
+                idle = False
+                dirty = True
+                mqtt_client.wait_msg()
+            
+            # Zurückgehaltenen PWM-Wert setzen
+            flush_pending_pwm()
+            
+            # Vorgemerktes ACK höchstens alle ACK_FLUSH_INTERVAL_MS senden
+            flush_pending_ack()
+            
+            # Keepalive: regelmäßig PING an den Broker senden
+            if ticks_diff(ticks_ms(), last_ping) > 30000:
+                mqtt_client.ping()
+                last_ping = ticks_ms()
+            
+            # Garbage Collection nur in Ruhephasen (keine Nachricht, kein offener PWM-Wert)
+            # und nur, wenn seit der letzten Collection Nachrichten verarbeitet wurden
+            if dirty and idle and pending_pwm_value is None and not interval_remaining_ms(last_collect, GC_INTERVAL_MS):
+                gc.collect()
+                last_collect = ticks_ms()
+                dirty = False
             
     except KeyboardInterrupt:
         print("\n\nProgramm beendet durch Benutzer")